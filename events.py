@@ -0,0 +1,102 @@
+import json
+import queue
+import threading
+
+
+class Subscription:
+    # Очередь событий одного SSE-соединения; переполненная очередь теряет самые старые события
+    def __init__(self, broker, channels, maxsize=100):
+        self.broker = broker
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    # Pub/sub внутри процесса: канал -> подписки. Без backend доставляет только в этот процесс
+    def __init__(self, backend=None):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.backend = backend
+        if backend is not None:
+            backend.start(self.deliver)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in subscription.channels:
+                self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.channels[channel]
+
+    def publish(self, channel, event, data):
+        # Событие сериализуется один раз сразу в формат SSE и в таком виде уходит всем подписчикам
+        message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        if self.backend is not None:
+            # Через backend событие вернётся в deliver() каждого процесса, включая этот
+            self.backend.publish(channel, message)
+        else:
+            self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'channels': len(self.channels),
+                'subscriptions': len({s for subscribers in self.channels.values() for s in subscribers}),
+                'backend': type(self.backend).__name__ if self.backend else None,
+            }
+
+
+class RedisBackend:
+    # Межпроцессная доставка через Redis PUBLISH/PSUBSCRIBE; пакет redis нужен только при его включении
+    def __init__(self, url, prefix='ywitter:events:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, message)
+
+    def start(self, deliver):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.prefix + '*')
+
+        def listen():
+            for item in pubsub.listen():
+                channel = item['channel'].decode()[len(self.prefix):]
+                deliver(channel, item['data'].decode())
+
+        threading.Thread(target=listen, name='ywitter-events', daemon=True).start()
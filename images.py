@@ -0,0 +1,108 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+
+from PIL import Image, ImageOps
+
+# Варианты: имя -> (максимальная сторона, квадратная обрезка)
+AVATAR_VARIANTS = {'48': (48, True), '96': (96, True), '256': (256, True)}
+MEDIA_VARIANTS = {'timeline': (680, False), 'full': (2048, False)}
+FORMATS = {'webp': dict(format='WEBP', quality=80, method=4),
+           'jpg': dict(format='JPEG', quality=82, optimize=True, progressive=True)}
+
+# Имя оригинала в базе: <sha256[:32]>.jpg для обработанных картинок, <hash>.gif для анимаций
+STORED_NAME_RE = re.compile(r'^([0-9a-f]{32})\.(jpg|gif)$')
+# Любой файл, названный по хешу содержимого (оригинал, вариант или видео), никогда не перезаписывается
+CONTENT_ADDRESSED_RE = re.compile(r'^[0-9a-f]{32}(_[0-9a-z]+)?\.[0-9a-z]+$')
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def is_content_addressed(filename):
+    return bool(CONTENT_ADDRESSED_RE.match(filename))
+
+
+def save_file(stream, folder, ext, chunk_size=1024 * 1024):
+    # Сохранение без перекодирования (видео): хеш считается по ходу записи,
+    # после чего временный файл переименовывается в <hash>.<ext>
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        name = f'{digest.hexdigest()[:32]}.{ext}'
+        os.replace(tmp_path, os.path.join(folder, name))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return name
+
+
+def variant_name(digest, variant, fmt):
+    return f'{digest}_{variant}.{fmt}'
+
+
+def _flatten(image):
+    # JPEG не умеет прозрачность: подкладываем белый фон
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _resize(image, size, square):
+    if square:
+        return ImageOps.fit(image, (size, size), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+def save_image(data, folder, variants):
+    # Возвращает имя для базы. Одинаковые загрузки дают одно имя и не пересчитываются.
+    # Метаданные (EXIF, GPS, ICC) отбрасываются: сохраняются только пиксели.
+    digest = content_hash(data)
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ValueError(f'Unsupported image: {exc}')
+    if getattr(image, 'is_animated', False) and image.format == 'GIF':
+        # Анимированные GIF храним как есть, иначе пропадёт анимация
+        name = f'{digest}.gif'
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        return name
+    name = f'{digest}.jpg'
+    if os.path.exists(os.path.join(folder, name)):
+        return name
+    image = _flatten(ImageOps.exif_transpose(image))
+    for variant, (size, square) in variants.items():
+        resized = _resize(image, size, square)
+        for fmt, options in FORMATS.items():
+            resized.save(os.path.join(folder, variant_name(digest, variant, fmt)), **options)
+    # Под именем из базы лежит копия самого крупного JPEG. Она пишется последней,
+    # поэтому её наличие означает, что все варианты готовы
+    largest = max(variants, key=lambda variant: variants[variant][0])
+    shutil.copyfile(os.path.join(folder, variant_name(digest, largest, 'jpg')), os.path.join(folder, name))
+    return name
+
+
+def variant_filename(stored_name, variant, fmt='webp'):
+    # Для старых имён (до конвейера) и GIF отдаём файл как есть
+    match = STORED_NAME_RE.match(stored_name or '')
+    if not match or match.group(2) == 'gif':
+        return stored_name
+    return variant_name(match.group(1), variant, fmt)
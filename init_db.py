@@ -1,14 +1,23 @@
-from app import app, db
-from flask_migrate import upgrade
+from main import app, db, backfill_derived_tables
+from flask_migrate import upgrade, stamp
+from sqlalchemy import inspect
 
 def init_db():
     with app.app_context():
+        existing_tables = set(inspect(db.engine).get_table_names())
+        fresh = 'user' not in existing_tables
+
         # Create all tables
         db.create_all()
-        
-        # Run any pending migrations
-        upgrade()
+
+        if fresh:
+            # Свежая схема уже совпадает с последней миграцией
+            stamp()
+        else:
+            # Run any pending migrations
+            upgrade()
+            backfill_derived_tables(existing_tables)
 
 if __name__ == '__main__':
     init_db()
-    print("Database initialized successfully!") 
\ No newline at end of file
+    print("Database initialized successfully!") 
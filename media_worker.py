@@ -0,0 +1,81 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def probe_video(filepath):
+    # Выполняется в дочернем процессе: moviepy загружается только в воркерах очереди
+    from moviepy import VideoFileClip
+    clip = VideoFileClip(filepath)
+    try:
+        return clip.duration
+    finally:
+        clip.close()
+
+
+class MediaQueue:
+    # Локальный пул процессов для обработки загрузок, без внешнего брокера.
+    # Колбэк завершения вызывается в служебном потоке родительского процесса
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        # Пул создаётся лениво, чтобы не порождать процессы при импорте приложения.
+        # spawn, а не fork: родитель многопоточный (SSE, вебхуки, фоновые задачи), и форк мог бы
+        # унаследовать чужую захваченную блокировку и зависнуть
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def submit(self, func, filepath, on_done):
+        started = time.monotonic()
+        with self.lock:
+            self.pending += 1
+
+        def finished(future):
+            elapsed = time.monotonic() - started
+            try:
+                result, error = future.result(), None
+            except Exception as exc:
+                result, error = None, exc
+            with self.lock:
+                self.pending -= 1
+                if error is None:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            on_done(result, error)
+
+        future = self._get_executor().submit(func, filepath)
+        future.add_done_callback(finished)
+        return future
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.lock:
+            done = self.processed + self.failed
+            return {
+                'queue_depth': self.pending,
+                'workers': self.workers,
+                'processed': self.processed,
+                'failed': self.failed,
+                'avg_processing_seconds': round(self.total_seconds / done, 3) if done else 0.0,
+                'max_processing_seconds': round(self.max_seconds, 3),
+            }
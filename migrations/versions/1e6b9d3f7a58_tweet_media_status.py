@@ -0,0 +1,26 @@
+"""media processing status on tweets
+
+Revision ID: 1e6b9d3f7a58
+Revises: f2c8e4b6a031
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e6b9d3f7a58'
+down_revision = 'f2c8e4b6a031'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tweet', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('media_status', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tweet', schema=None) as batch_op:
+        batch_op.drop_column('media_status')
@@ -0,0 +1,28 @@
+"""user indexes for the admin panel
+
+Revision ID: 2f7a9c1e4b83
+Revises: 6d2b8f4c9e15
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f7a9c1e4b83'
+down_revision = '6d2b8f4c9e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_created_at_id', ['created_at', 'id'])
+        batch_op.create_index('ix_user_is_banned_created_at_id', ['is_banned', 'created_at', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_is_banned_created_at_id')
+        batch_op.drop_index('ix_user_created_at_id')
@@ -0,0 +1,54 @@
+"""hot table indexes and unique constraints
+
+Revision ID: 3c1e9a7d5b20
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1e9a7d5b20'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+UNIQUE_INDEXES = [
+    ('uq_follow_follower_followed', 'follow', ['follower_id', 'followed_id']),
+    ('uq_like_tweet_user', 'like', ['tweet_id', 'user_id']),
+    ('uq_retweet_tweet_user', 'retweet', ['tweet_id', 'user_id']),
+    ('uq_reaction_tweet_user_type', 'reaction', ['tweet_id', 'user_id', 'reaction_type']),
+    ('uq_poll_vote_poll_user', 'poll_vote', ['poll_id', 'user_id']),
+    ('uq_tweet_hashtag_hashtag_tweet', 'tweet_hashtag', ['hashtag_id', 'tweet_id']),
+]
+
+INDEXES = [
+    ('ix_follow_followed_follower', 'follow', ['followed_id', 'follower_id']),
+    ('ix_message_recipient_timestamp', 'message', ['recipient_id', 'timestamp']),
+    ('ix_message_sender_timestamp', 'message', ['sender_id', 'timestamp']),
+    ('ix_notification_user_created_at', 'notification', ['user_id', 'created_at']),
+    ('ix_tweet_hashtag_tweet_id', 'tweet_hashtag', ['tweet_id']),
+]
+
+
+def delete_duplicates(table_name, columns):
+    # Оставляем самую раннюю строку из каждой группы дублей, иначе уникальный индекс не создастся
+    table = sa.table(table_name, sa.column('id'), *[sa.column(name) for name in columns])
+    keep = sa.select(sa.func.min(table.c.id).label('id')) \
+        .group_by(*[table.c[name] for name in columns]).subquery('keep')
+    op.execute(table.delete().where(table.c.id.notin_(sa.select(keep.c.id))))
+
+
+def upgrade():
+    for name, table_name, columns in UNIQUE_INDEXES:
+        delete_duplicates(table_name, columns)
+        op.create_index(name, table_name, columns, unique=True)
+    for name, table_name, columns in INDEXES:
+        op.create_index(name, table_name, columns)
+
+
+def downgrade():
+    for name, table_name, _ in reversed(INDEXES + UNIQUE_INDEXES):
+        op.drop_index(name, table_name=table_name)
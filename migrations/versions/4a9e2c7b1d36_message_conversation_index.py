@@ -0,0 +1,26 @@
+"""composite index on message (sender_id, recipient_id, id) for chat history pages
+
+Revision ID: 4a9e2c7b1d36
+Revises: 1e6b9d3f7a58
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9e2c7b1d36'
+down_revision = '1e6b9d3f7a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_sender_recipient_id', ['sender_id', 'recipient_id', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_sender_recipient_id')
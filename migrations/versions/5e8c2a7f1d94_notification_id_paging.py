@@ -0,0 +1,28 @@
+"""page notifications by id
+
+Revision ID: 5e8c2a7f1d94
+Revises: 7b4e1d9a3c62
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8c2a7f1d94'
+down_revision = '7b4e1d9a3c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.create_index('ix_notification_user_id', ['user_id', 'id'])
+        batch_op.drop_index('ix_notification_user_created_at')
+
+
+def downgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.create_index('ix_notification_user_created_at', ['user_id', 'created_at'])
+        batch_op.drop_index('ix_notification_user_id')
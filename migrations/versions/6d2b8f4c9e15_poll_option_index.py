@@ -0,0 +1,26 @@
+"""poll option lookup by poll
+
+Revision ID: 6d2b8f4c9e15
+Revises: b7d1a4e9c562
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2b8f4c9e15'
+down_revision = 'b7d1a4e9c562'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('poll_option', schema=None) as batch_op:
+        batch_op.create_index('ix_poll_option_poll_id', ['poll_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('poll_option', schema=None) as batch_op:
+        batch_op.drop_index('ix_poll_option_poll_id')
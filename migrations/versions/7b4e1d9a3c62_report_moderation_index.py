@@ -0,0 +1,26 @@
+"""pending report index for the moderation queue
+
+Revision ID: 7b4e1d9a3c62
+Revises: 2f7a9c1e4b83
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b4e1d9a3c62'
+down_revision = '2f7a9c1e4b83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('report', schema=None) as batch_op:
+        batch_op.create_index('ix_report_status_target_reporter', ['status', 'tweet_id', 'reported_user_id', 'reporter_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('report', schema=None) as batch_op:
+        batch_op.drop_index('ix_report_status_target_reporter')
@@ -0,0 +1,59 @@
+"""denormalized tweet counters and follower counts
+
+Revision ID: 8b4d2f6a0e13
+Revises: 3c1e9a7d5b20
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4d2f6a0e13'
+down_revision = '3c1e9a7d5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tweet', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('retweet_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('reply_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index('ix_tweet_created_at_id', ['created_at', 'id'])
+        batch_op.create_index('ix_tweet_user_created_at_id', ['user_id', 'created_at', 'id'])
+        batch_op.create_index('ix_tweet_reply_to_id', ['reply_to_id'])
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Начальные значения; дальше их поддерживают `flask reconcile-counters` и `flask backfill-timelines`
+    tweet = sa.table('tweet', sa.column('id'), sa.column('reply_to_id'),
+                     sa.column('like_count'), sa.column('retweet_count'), sa.column('reply_count'))
+    like = sa.table('like', sa.column('id'), sa.column('tweet_id'))
+    retweet = sa.table('retweet', sa.column('id'), sa.column('tweet_id'))
+    reply = tweet.alias('reply')
+    op.execute(tweet.update().values(
+        like_count=sa.select(sa.func.count(like.c.id)).where(like.c.tweet_id == tweet.c.id).scalar_subquery(),
+        retweet_count=sa.select(sa.func.count(retweet.c.id)).where(retweet.c.tweet_id == tweet.c.id).scalar_subquery(),
+        reply_count=sa.select(sa.func.count(reply.c.id)).where(reply.c.reply_to_id == tweet.c.id).scalar_subquery(),
+    ))
+    user = sa.table('user', sa.column('id'), sa.column('followers_count'))
+    follow = sa.table('follow', sa.column('id'), sa.column('followed_id'))
+    op.execute(user.update().values(
+        followers_count=sa.select(sa.func.count(follow.c.id)).where(follow.c.followed_id == user.c.id).scalar_subquery()
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('followers_count')
+
+    with op.batch_alter_table('tweet', schema=None) as batch_op:
+        batch_op.drop_index('ix_tweet_reply_to_id')
+        batch_op.drop_index('ix_tweet_user_created_at_id')
+        batch_op.drop_index('ix_tweet_created_at_id')
+        batch_op.drop_column('reply_count')
+        batch_op.drop_column('retweet_count')
+        batch_op.drop_column('like_count')
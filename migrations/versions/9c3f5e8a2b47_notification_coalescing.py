@@ -0,0 +1,47 @@
+"""coalesced notifications and cached unread counter
+
+Revision ID: 9c3f5e8a2b47
+Revises: 4a9e2c7b1d36
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3f5e8a2b47'
+down_revision = '4a9e2c7b1d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('actor_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('actor_count', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_foreign_key('fk_notification_actor_id_user', 'user', ['actor_id'], ['id'])
+        batch_op.create_index('ix_notification_user_type_is_read', ['user_id', 'type', 'is_read'])
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_notifications', sa.Integer(), server_default='0', nullable=False))
+
+    user = sa.table('user', sa.column('id'), sa.column('unread_notifications'))
+    notification = sa.table('notification', sa.column('id'), sa.column('user_id'), sa.column('is_read'))
+    op.execute(user.update().values(
+        unread_notifications=sa.select(sa.func.count(notification.c.id))
+            .where(notification.c.user_id == user.c.id,
+                   sa.or_(notification.c.is_read == sa.false(), notification.c.is_read.is_(None)))
+            .scalar_subquery()
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('unread_notifications')
+
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_user_type_is_read')
+        batch_op.drop_constraint('fk_notification_actor_id_user', type_='foreignkey')
+        batch_op.drop_column('actor_count')
+        batch_op.drop_column('actor_id')
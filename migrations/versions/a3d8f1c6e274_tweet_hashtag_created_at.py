@@ -0,0 +1,36 @@
+"""copy tweet.created_at into tweet_hashtag for index-backed hashtag timelines
+
+Revision ID: a3d8f1c6e274
+Revises: 5e8c2a7f1d94
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d8f1c6e274'
+down_revision = '5e8c2a7f1d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tweet_hashtag', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+
+    tweet = sa.table('tweet', sa.column('id'), sa.column('created_at'))
+    tweet_hashtag = sa.table('tweet_hashtag', sa.column('tweet_id'), sa.column('created_at'))
+    op.execute(tweet_hashtag.update().values(
+        created_at=sa.select(tweet.c.created_at).where(tweet.c.id == tweet_hashtag.c.tweet_id).scalar_subquery()
+    ))
+
+    with op.batch_alter_table('tweet_hashtag', schema=None) as batch_op:
+        batch_op.create_index('ix_tweet_hashtag_hashtag_created_at', ['hashtag_id', 'created_at', 'tweet_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('tweet_hashtag', schema=None) as batch_op:
+        batch_op.drop_index('ix_tweet_hashtag_hashtag_created_at')
+        batch_op.drop_column('created_at')
@@ -0,0 +1,28 @@
+"""webhook delivery failure counter and user index
+
+Revision ID: b7d1a4e9c562
+Revises: 9c3f5e8a2b47
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d1a4e9c562'
+down_revision = '9c3f5e8a2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('webhook', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('failure_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index('ix_webhook_user_id', ['user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('webhook', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_user_id')
+        batch_op.drop_column('failure_count')
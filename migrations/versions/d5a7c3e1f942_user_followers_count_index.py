@@ -0,0 +1,26 @@
+"""index on user.followers_count for the popular users leaderboard
+
+Revision ID: d5a7c3e1f942
+Revises: 8b4d2f6a0e13
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a7c3e1f942'
+down_revision = '8b4d2f6a0e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_followers_count', ['followers_count'])
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_followers_count')
@@ -0,0 +1,56 @@
+"""FTS5 full-text search index for tweets and users
+
+Revision ID: f2c8e4b6a031
+Revises: d5a7c3e1f942
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8e4b6a031'
+down_revision = 'd5a7c3e1f942'
+branch_labels = None
+depends_on = None
+
+# Копия main.SEARCH_INDEX_DDL на момент ревизии
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tweet_fts USING fts5("
+    "content, content='tweet', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS tweet_fts_ai AFTER INSERT ON tweet BEGIN "
+    "INSERT INTO tweet_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS tweet_fts_ad AFTER DELETE ON tweet BEGIN "
+    "INSERT INTO tweet_fts(tweet_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS tweet_fts_au AFTER UPDATE OF content ON tweet BEGIN "
+    "INSERT INTO tweet_fts(tweet_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO tweet_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5("
+    "username, bio, content='user', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS user_fts_ai AFTER INSERT ON \"user\" BEGIN "
+    "INSERT INTO user_fts(rowid, username, bio) VALUES (new.id, new.username, new.bio); END",
+    "CREATE TRIGGER IF NOT EXISTS user_fts_ad AFTER DELETE ON \"user\" BEGIN "
+    "INSERT INTO user_fts(user_fts, rowid, username, bio) VALUES ('delete', old.id, old.username, old.bio); END",
+    "CREATE TRIGGER IF NOT EXISTS user_fts_au AFTER UPDATE OF username, bio ON \"user\" BEGIN "
+    "INSERT INTO user_fts(user_fts, rowid, username, bio) VALUES ('delete', old.id, old.username, old.bio); "
+    "INSERT INTO user_fts(rowid, username, bio) VALUES (new.id, new.username, new.bio); END",
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in SEARCH_INDEX_DDL:
+        op.execute(statement)
+    op.execute("INSERT INTO tweet_fts(tweet_fts) VALUES ('rebuild')")
+    op.execute("INSERT INTO user_fts(user_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('tweet_fts_ai', 'tweet_fts_ad', 'tweet_fts_au', 'user_fts_ai', 'user_fts_ad', 'user_fts_au'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS tweet_fts')
+    op.execute('DROP TABLE IF EXISTS user_fts')
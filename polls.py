@@ -0,0 +1,82 @@
+import atexit
+import threading
+import time
+from collections import Counter
+
+
+class VoteBuffer:
+    # Голоса копятся в памяти и раз в interval секунд уходят в базу одной пачкой: flush(counts)
+    # получает {option_id: число голосов}. Горячая строка варианта обновляется раз за пачку, а не на каждый голос
+    def __init__(self, flush, interval=1.0):
+        self.flush_func = flush
+        self.interval = interval
+        self.pending = Counter()
+        self.inflight = Counter()  # забраны из pending, но ещё не записаны
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.flushed = 0
+        self.batches = 0
+        self.errors = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='ywitter-votes', daemon=True)
+                self.thread.start()
+                # Остаток дописывается при штатной остановке процесса; при падении его восстановит reconcile-poll-votes
+                atexit.register(self.flush)
+
+    def add(self, option_id, count=1):
+        self.start()
+        with self.lock:
+            self.pending[option_id] += count
+
+    def pending_for(self, option_ids):
+        with self.lock:
+            return {option_id: self.pending[option_id] + self.inflight[option_id]
+                    for option_id in option_ids if option_id in self.pending or option_id in self.inflight}
+
+    def buffered(self):
+        # Варианты, прибавки которых ещё не записаны в базу
+        with self.lock:
+            return set(self.pending) | set(self.inflight)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                counts, self.pending = self.pending, Counter()
+                self.inflight = counts
+            if not counts:
+                return 0
+            try:
+                self.flush_func(dict(counts))
+            except Exception:
+                # Неудачная пачка возвращается в буфер и уйдёт со следующей
+                with self.lock:
+                    self.pending.update(counts)
+                    self.inflight = Counter()
+                    self.errors += 1
+                raise
+            with self.lock:
+                self.inflight = Counter()
+                self.flushed += sum(counts.values())
+                self.batches += 1
+            return len(counts)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': sum(self.pending.values()) + sum(self.inflight.values()),
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'errors': self.errors,
+            }
@@ -122,6 +122,13 @@ RU_TRANSLATIONS = {
     'Create a Tweet': 'Создать твит',
     "What's happening?": 'Что происходит?',
     'Trending': 'В тренде',
+    'Load more': 'Показать ещё',
+    'Users': 'Пользователи',
+    'Nothing found': 'Ничего не найдено',
+    'Video is processing...': 'Видео обрабатывается...',
+    'Video could not be processed': 'Не удалось обработать видео',
+    'You': 'Вы',
+    'New tweets': 'Новые твиты',
     'Delete Tweet': 'Удалить твит',
     'Your reply...': 'Ваш ответ...',
     'Your dialogs': 'Ваши диалоги',
@@ -256,6 +263,13 @@ EN_TRANSLATIONS = {
     'Create a Tweet': 'Create a Tweet',
     "What's happening?": "What's happening?",
     'Trending': 'Trending',
+    'Load more': 'Load more',
+    'Users': 'Users',
+    'Nothing found': 'Nothing found',
+    'Video is processing...': 'Video is processing...',
+    'Video could not be processed': 'Video could not be processed',
+    'You': 'You',
+    'New tweets': 'New tweets',
     'Delete Tweet': 'Delete Tweet',
     'Your reply...': 'Your reply...',
     'Your dialogs': 'Your dialogs',
@@ -266,7 +280,23 @@ EN_TRANSLATIONS = {
     'Allow direct messages (disable to receive requests only)': 'Allow direct messages (disable to receive requests only)',
 }
 
+SUPPORTED_LOCALES = ('ru', 'en')
+DEFAULT_LOCALE = 'ru'
+
+# Каталоги собираются один раз при импорте; любой язык, кроме русского, получает английский
+CATALOGS = {'ru': dict(RU_TRANSLATIONS), 'en': dict(EN_TRANSLATIONS)}
+
 def get_translation(key, lang='ru'):
-    if lang == 'ru':
-        return RU_TRANSLATIONS.get(key, key)
-    return EN_TRANSLATIONS.get(key, key)
+    return CATALOGS.get(lang, CATALOGS['en']).get(key, key)
+
+def make_translator(lang):
+    # Перевод для шаблонов с уже выбранным каталогом: один dict.get на строку.
+    # Второй аргумент оставлен для совместимости с вызовами _('...', lang) в шаблонах
+    catalog = CATALOGS.get(lang, CATALOGS['en'])
+    def translate(key, lang_override=None):
+        if lang_override is not None and lang_override != lang:
+            return get_translation(key, lang_override)
+        return catalog.get(key, key)
+    return translate
+
+TRANSLATORS = {lang: make_translator(lang) for lang in SUPPORTED_LOCALES}
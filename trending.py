@@ -0,0 +1,97 @@
+import math
+import threading
+import time
+from collections import Counter, deque
+
+
+class TrendingHashtags:
+    # Скользящее окно по минутным корзинам: счётчики окна (1 час) и базы (24 часа)
+    # поддерживаются инкрементально, поэтому запись и чтение топа не зависят от объёма истории
+    def __init__(self, bucket_seconds=60, window_seconds=3600, baseline_seconds=86400,
+                 refresh_seconds=30, size=10, min_count=2):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_seconds // bucket_seconds
+        self.baseline_buckets = baseline_seconds // bucket_seconds
+        self.refresh_seconds = refresh_seconds
+        self.size = size
+        self.min_count = min_count
+        self.buckets = deque()  # [номер корзины, Counter, ещё в часовом окне]
+        self.window = Counter()
+        self.baseline = Counter()
+        self.ranking = []
+        self.ranked_at = 0
+        self.lock = threading.Lock()
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def _expire(self, now_bucket):
+        window_start = now_bucket - self.window_buckets + 1
+        baseline_start = now_bucket - self.baseline_buckets + 1
+        while self.buckets and self.buckets[0][0] < baseline_start:
+            _, counts, in_window = self.buckets.popleft()
+            self.baseline.subtract(counts)
+            if in_window:
+                self.window.subtract(counts)
+        for bucket in self.buckets:
+            if bucket[0] >= window_start:
+                break
+            if bucket[2]:
+                self.window.subtract(bucket[1])
+                bucket[2] = False
+        self.window += Counter()
+        self.baseline += Counter()
+
+    def record(self, names, timestamp=None):
+        if not names:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        number = self._bucket(timestamp)
+        with self.lock:
+            if not self.buckets or self.buckets[-1][0] < number:
+                self.buckets.append([number, Counter(), True])
+            # Запоздавшие события попадают в свою корзину, если она ещё хранится
+            bucket = next((b for b in reversed(self.buckets) if b[0] == number), None)
+            if bucket is None:
+                return
+            bucket[1].update(names)
+            if bucket[2]:
+                self.window.update(names)
+            self.baseline.update(names)
+
+    def load(self, events, now=None):
+        # Прогрев из базы: events — пары (name, timestamp) за последние сутки
+        now = time.time() if now is None else now
+        buckets = {}
+        for name, timestamp in events:
+            buckets.setdefault(self._bucket(timestamp), Counter())[name] += 1
+        with self.lock:
+            window_start = self._bucket(now) - self.window_buckets + 1
+            self.buckets = deque([number, counts, number >= window_start]
+                                 for number, counts in sorted(buckets.items()))
+            self.window = Counter()
+            self.baseline = Counter()
+            for _, counts, in_window in self.buckets:
+                self.baseline.update(counts)
+                if in_window:
+                    self.window.update(counts)
+            self.ranked_at = 0
+
+    def score(self, name):
+        # Скорость относительно базы: насколько текущий час выше среднего часа за сутки
+        current = self.window[name]
+        hours = self.baseline_buckets / self.window_buckets
+        expected = (self.baseline[name] - current) / max(hours - 1, 1)
+        return (current - expected) / math.sqrt(expected + 1)
+
+    def top(self, n=None, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if now - self.ranked_at >= self.refresh_seconds:
+                self._expire(self._bucket(now))
+                candidates = [name for name, count in self.window.items() if count >= self.min_count]
+                scored = sorted(((self.score(name), self.window[name], name) for name in candidates), reverse=True)
+                self.ranking = [dict(name=name, count=count, score=round(score, 2))
+                                for score, count, name in scored[:self.size] if score > 0]
+                self.ranked_at = now
+            return self.ranking[:n or self.size]
@@ -0,0 +1,244 @@
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import queue
+import random
+import socket
+import ssl
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class UnsafeURLError(ValueError):
+    pass
+
+
+def check_url(url, allowed_hosts=()):
+    # Защита от SSRF: хост резолвится, и ни один его адрес не должен вести в loopback, частную,
+    # link-local или зарезервированную сеть. allowed_hosts — явные исключения (например, тестовый приёмник на localhost).
+    # Возвращает адрес, к которому нужно подключаться, чтобы повторный резолв не подменил проверенный адрес
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise UnsafeURLError('URL must be http(s)')
+    if parts.hostname.lower() in allowed_hosts:
+        return parts.hostname
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise UnsafeURLError(f'Cannot resolve {parts.hostname}')
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if (address.is_loopback or address.is_private or address.is_link_local or address.is_reserved
+                or address.is_multicast or address.is_unspecified):
+            raise UnsafeURLError(f'{parts.hostname} resolves to a non-public address')
+    return infos[0][4][0]
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    # TCP идёт на заранее проверенный адрес, а Host берётся из исходного имени
+    def __init__(self, host, address, port=None, timeout=5):
+        super().__init__(host, port, timeout=timeout)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class PinnedHTTPSConnection(PinnedHTTPConnection):
+    # То же для https: SNI и проверка сертификата — по исходному имени хоста
+    default_port = http.client.HTTPS_PORT
+
+    def __init__(self, host, address, port=None, timeout=5):
+        super().__init__(host, address, port, timeout)
+        self.ssl_context = ssl.create_default_context()
+
+    def connect(self):
+        super().connect()
+        self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+class ConnectionPool:
+    # Keep-alive соединения по хосту: повторные доставки на тот же endpoint не платят за TCP/TLS
+    def __init__(self, size=4, timeout=5, allowed_hosts=()):
+        self.size = size
+        self.timeout = timeout
+        self.allowed_hosts = allowed_hosts
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _connect(self, parts, address):
+        cls = PinnedHTTPSConnection if parts.scheme == 'https' else PinnedHTTPConnection
+        return cls(parts.hostname, address, parts.port, timeout=self.timeout)
+
+    def post(self, url, body, headers):
+        # DNS мог измениться после регистрации хука, поэтому адрес проверяется перед каждой доставкой,
+        # и соединение открывается именно к нему; простаивающие соединения привязаны к адресу
+        address = check_url(url, self.allowed_hosts)
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc, address)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        with self.lock:
+            conn = self.idle.get(key, []).pop() if self.idle.get(key) else None
+        reused = conn is not None
+        while True:
+            conn = conn or self._connect(parts, address)
+            try:
+                conn.request('POST', path, body, headers)
+                response = conn.getresponse()
+                response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # Сервер мог закрыть простаивавшее соединение: одна повторная попытка на новом
+                if not reused:
+                    raise
+                conn, reused = None, False
+            except Exception:
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self.lock:
+                idle = self.idle.setdefault(key, [])
+                if len(idle) < self.size:
+                    idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return response.status
+
+
+class WebhookDispatcher:
+    # Очередь доставки в памяти процесса. События одного хука уходят пачками и по порядку;
+    # неудачная пачка повторяется с экспоненциальной задержкой, после max_attempts — on_result(hook_id, False, error).
+    # on_result(hook_id, True, None) вызывается при первом успехе после таких сбоев
+    def __init__(self, workers=4, batch_size=20, batch_wait=0.5, max_attempts=5,
+                 backoff_base=1.0, backoff_max=300, timeout=5, on_result=None, allowed_hosts=()):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_result = on_result
+        self.pool = ConnectionPool(timeout=timeout, allowed_hosts=allowed_hosts)
+        self.workers = workers
+        self.executor = None
+        self.inbox = queue.Queue()
+        self.hooks = {}  # hook_id -> состояние: url, secret, очередь, попытка, время повтора, занят ли
+        self.lock = threading.Lock()
+        self.thread = None
+        self.delivered = 0
+        self.failed = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ywitter-webhook')
+                self.thread = threading.Thread(target=self._run, name='ywitter-webhooks', daemon=True)
+                self.thread.start()
+
+    def enqueue(self, hook_id, url, secret, event, data):
+        self.start()
+        self.inbox.put((hook_id, url, secret, {
+            'id': uuid.uuid4().hex,
+            'event': event,
+            'created_at': time.time(),
+            'data': data,
+        }))
+
+    def drop(self, hook_id):
+        # Хук отключён: всё, что ещё ждёт отправки, выбрасывается
+        self.inbox.put((hook_id, None, None, None))
+
+    def _run(self):
+        while True:
+            try:
+                item = self.inbox.get(timeout=self.batch_wait / 2)
+            except queue.Empty:
+                item = None
+            now = time.monotonic()
+            with self.lock:
+                if item is not None:
+                    hook_id, url, secret, delivery = item
+                    if delivery is None:
+                        self.hooks.pop(hook_id, None)
+                    else:
+                        state = self.hooks.setdefault(hook_id, dict(pending=deque(), attempt=0, failures=0, retry_at=0, busy=False))
+                        state.update(url=url, secret=secret)
+                        state['pending'].append((now, delivery))
+                ready = []
+                for hook_id, state in self.hooks.items():
+                    pending = state['pending']
+                    if state['busy'] or not pending or state['retry_at'] > now:
+                        continue
+                    if len(pending) >= self.batch_size or now - pending[0][0] >= self.batch_wait:
+                        batch = [pending.popleft()[1] for _ in range(min(self.batch_size, len(pending)))]
+                        state['busy'] = True
+                        ready.append((hook_id, state['url'], state['secret'], batch))
+            for hook_id, url, secret, batch in ready:
+                self.executor.submit(self._deliver, hook_id, url, secret, batch)
+
+    def _deliver(self, hook_id, url, secret, batch):
+        body = json.dumps({'deliveries': batch}).encode()
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'Ywitter-Webhooks/1.0',
+            'X-Ywitter-Event': ','.join(sorted({delivery['event'] for delivery in batch})),
+            'X-Ywitter-Delivery': batch[0]['id'],
+            'X-Ywitter-Signature': sign(secret, body),
+        }
+        try:
+            status = self.pool.post(url, body, headers)
+            error = None if 200 <= status < 300 else f'HTTP {status}'
+        except Exception as exc:
+            error = str(exc) or type(exc).__name__
+        with self.lock:
+            state = self.hooks.get(hook_id)
+            if state is None:
+                return
+            state['busy'] = False
+            if error is None:
+                self.delivered += len(batch)
+                state['attempt'] = 0
+                # Об успехе сообщаем, только если до него были исчерпанные пачки (сброс счётчика сбоев)
+                notify, state['failures'] = state['failures'] > 0, 0
+            else:
+                state['attempt'] += 1
+                if state['attempt'] < self.max_attempts:
+                    # Пачка возвращается в начало очереди хука и ждёт backoff с джиттером
+                    delay = min(self.backoff_base * 2 ** (state['attempt'] - 1), self.backoff_max)
+                    state['retry_at'] = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                    state['pending'].extendleft((0, delivery) for delivery in reversed(batch))
+                    return
+                self.failed += len(batch)
+                state['attempt'] = 0
+                state['failures'] += 1
+                notify = True
+        if notify and self.on_result is not None:
+            self.on_result(hook_id, error is None, error)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hooks': len(self.hooks),
+                'pending': sum(len(state['pending']) for state in self.hooks.values()) + self.inbox.qsize(),
+                'delivered': self.delivered,
+                'failed': self.failed,
+            }